@@ -0,0 +1,87 @@
+"""
+Moves issues that were closed long ago from `issues` to `issues_archive`.
+
+Keeps the hot `issues` table down to open and recently closed issues, so
+/issues and /myissues cost the same no matter how much history piles up.
+Search still covers archived rows.
+
+Each batch is copied and deleted in its own transaction, so the job can be
+stopped at any point and simply run again.
+
+Usage:
+    python archive.py --days 90 --batch-size 500
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, delete
+
+from models import SessionLocal, Issue, ArchivedIssue
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+DEFAULT_BATCH_SIZE = 500
+
+# Columns copied as-is from issues to issues_archive
+ARCHIVED_COLUMNS = [
+    'id', 'title', 'message', 'created_by', 'status', 'created_at',
+    'resolution', 'closed_by', 'closed_at', 'telegram_message_id',
+    'attachment_type', 'attachment_file_id', 'target_manager_id'
+]
+
+
+def archive_batch(session, cutoff: datetime, batch_size: int):
+    """
+    Archives up to batch_size issues closed before cutoff.
+    Returns the number of issues moved.
+    """
+    ids = session.scalars(
+        select(Issue.id)
+        .where(Issue.status == 'closed', Issue.closed_at < cutoff)
+        .order_by(Issue.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    if not ids:
+        return 0
+
+    source_columns = [getattr(Issue, name) for name in ARCHIVED_COLUMNS]
+    session.execute(
+        insert(ArchivedIssue).from_select(
+            ARCHIVED_COLUMNS,
+            select(*source_columns).where(Issue.id.in_(ids))
+        )
+    )
+    session.execute(delete(Issue).where(Issue.id.in_(ids)))
+    return len(ids)
+
+
+def archive_closed_issues(days: int = DEFAULT_ARCHIVE_AFTER_DAYS, batch_size: int = DEFAULT_BATCH_SIZE):
+    """Archives every issue closed more than `days` ago. Returns the total moved."""
+    cutoff = datetime.now() - timedelta(days=days)
+    total = 0
+
+    while True:
+        with SessionLocal() as session:
+            with session.begin():
+                moved = archive_batch(session, cutoff, batch_size)
+
+        if not moved:
+            break
+
+        total += moved
+        print(f"Archived {moved} issues ({total} so far)")
+
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive issues closed more than N days ago.")
+    parser.add_argument('--days', type=int, default=DEFAULT_ARCHIVE_AFTER_DAYS,
+                        help=f"archive issues closed more than this many days ago (default {DEFAULT_ARCHIVE_AFTER_DAYS})")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"issues moved per transaction (default {DEFAULT_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    archived = archive_closed_issues(args.days, args.batch_size)
+    print(f"✅ Archived {archived} closed issues.")
@@ -1,37 +1,61 @@
-from models import User, Issue, init_db
+from models import (User, Issue, ProcessedUpdate, ScheduledJob, init_db, get_engine, SessionLocal, ReadSessionLocal,
+                    read_session, pin_to_primary, SEARCH_CONFIG)
+from stats import record_issue_opened, record_issue_closed, get_issue_stats
+from hierarchy import add_to_hierarchy, get_subordinate_ids
+from scheduler import Scheduler, schedule_job, cancel_issue_jobs, cancel_job
 
 import os
+import re
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, text, select, delete
 
 import telebot
 from telebot import apihelper, types
 
-load_dotenv()  # Take environment variables from .env.
+# Created by create_bot(). Handlers below only touch them once updates arrive.
+bot = None
+scheduler = None
 
-bot_token = os.getenv('BOT_TOKEN')
-BOT_TOKEN = bot_token
+BOT_TOKEN = None
+ADMIN_ID = None
 
-# CRITICAL STEP: Override the server URL to point to Baleh
-apihelper.API_URL = "https://tapi.bale.ai/bot{0}/{1}"
+POLL_LIMIT = 100
+POLL_TIMEOUT = 20
 
-# Initialize the bot
-bot = telebot.TeleBot(BOT_TOKEN)
+# Reminders go to the creator of an open issue after REMINDER_AFTER_HOURS and then
+# every REMINDER_INTERVAL_HOURS; the creator's manager is told after ESCALATE_AFTER_HOURS
+REMINDER_AFTER_HOURS = 24
+REMINDER_INTERVAL_HOURS = 24
+ESCALATE_AFTER_HOURS = 72
 
-database_url = os.getenv('DATABASE_URL')
-DATABASE_URL = database_url
+# Parallel Bot API calls during a broadcast
+BROADCAST_WORKERS = 8
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+# Times a message is retried after a 429 (flood limit) before counting it as failed
+FLOOD_RETRIES = 3
 
-# Get admin ID from environment
-try:
-    ADMIN_ID = int(os.getenv('ADMIN_ID'))
-except (ValueError, TypeError):
-    print("Warning: ADMIN_ID not set or invalid. Broadcast functionality will be disabled.")
-    ADMIN_ID = None
+# Bot API limit for photo/document captions
+CAPTION_LIMIT = 1024
+
+# How many recent update IDs to remember for de-duplication
+PROCESSED_UPDATES_KEEP = 10000
+
+SEARCH_PAGE_SIZE = 10
+
+# Live issues plus the ones moved out by archive.py
+SEARCHED_TABLES = ("issues", "issues_archive")
+
+# Databases with a full-text index (see models.init_search)
+SEARCH_DIALECTS = ("postgresql", "sqlite")
+
+# Last /search terms per chat, so the paging buttons don't have to carry them
+# (callback data is limited to 64 bytes).
+last_search_terms = {}
 
 
 # --- DATABASE FUNCTIONS ---
@@ -54,6 +78,7 @@ def add_user(user_id: int, first_name: str = None, username: str = None):
                     status="pending_approval"
                 )
                 session.add(new_user)
+                add_to_hierarchy(session, user_id)
                 return True
 
             return False
@@ -61,13 +86,22 @@ def add_user(user_id: int, first_name: str = None, username: str = None):
 
 def get_all_users():
     """Returns a list of all user IDs."""
-    with SessionLocal() as session:
+    # Broadcast recipients don't need to be up to the second, so read from the replica
+    with ReadSessionLocal() as session:
         users = session.query(User.user_id).all()
         return [user.user_id for user in users]
 
 
+def get_issue_recipients(target_manager_id: int = None):
+    """Everyone an issue goes to: all users, or one manager's reporting subtree."""
+    if target_manager_id is None:
+        return get_all_users()
+    return get_subordinate_ids(target_manager_id)
+
+
 def is_admin(user_id: int):
     """Check if user is an admin."""
+    # Stays on the primary so a role change takes effect immediately
     with SessionLocal() as session:
         user = session.get(User, user_id)
         if user:
@@ -75,7 +109,7 @@ def is_admin(user_id: int):
         return False
 
 
-def create_issue(title: str, message: str, created_by: int):
+def create_issue(title: str, message: str, created_by: int, target_manager_id: int = None):
     """Create a new issue in the database."""
     with SessionLocal() as session:
         with session.begin():
@@ -83,17 +117,109 @@ def create_issue(title: str, message: str, created_by: int):
                 title=title,
                 message=message,
                 created_by=created_by,
-                status="open"
+                status="open",
+                target_manager_id=target_manager_id
             )
             session.add(new_issue)
             session.flush()  # Get the ID before committing
+            record_issue_opened(session, new_issue)
             issue_id = new_issue.id
-            return issue_id
 
+            jobs = schedule_issue_jobs(session, issue_id, created_by, datetime.now())
+            due = [(job.id, job.run_at) for job in jobs]
+
+    if scheduler:
+        for job_id, run_at in due:
+            scheduler.add(job_id, run_at)
 
-def get_open_issues():
-    """Get all open issues."""
+    # The creator should see the new issue right away, even if the replica lags
+    pin_to_primary(created_by)
+    return issue_id
+
+
+def schedule_issue_jobs(session, issue_id: int, created_by: int, opened_at: datetime,
+                        reminder: bool = True, escalation: bool = True):
+    """
+    Adds the jobs that remind the creator while an issue stays open and
+    escalate it if it's open too long. Returns the new jobs.
+    """
+    jobs = []
+    if reminder:
+        jobs.append(schedule_job(session, 'issue_reminder', opened_at + timedelta(hours=REMINDER_AFTER_HOURS),
+                                 interval_seconds=int(REMINDER_INTERVAL_HOURS * 3600),
+                                 issue_id=issue_id, created_by=created_by))
+    if escalation:
+        jobs.append(schedule_job(session, 'issue_escalation', opened_at + timedelta(hours=ESCALATE_AFTER_HOURS),
+                                 issue_id=issue_id, created_by=created_by))
+    return jobs
+
+
+def backfill_issue_jobs():
+    """
+    Schedules reminders and escalations for open issues created before the
+    scheduler existed. Issues that already have a job of a kind (in any
+    state) are left alone, so it is safe to run more than once.
+    Jobs that are already overdue fire as soon as the scheduler starts.
+    Returns the number of jobs added.
+    """
+    with SessionLocal() as session:
+        with session.begin():
+            issues = session.execute(
+                select(Issue.id, Issue.created_by, Issue.created_at).where(Issue.status == 'open')
+            ).all()
+            scheduled = set(session.execute(
+                select(ScheduledJob.issue_id, ScheduledJob.kind)
+                .where(ScheduledJob.issue_id.is_not(None))
+                .distinct()
+            ).all())
+
+            added = 0
+            for issue_id, created_by, created_at in issues:
+                added += len(schedule_issue_jobs(
+                    session, issue_id, created_by, created_at,
+                    reminder=(issue_id, 'issue_reminder') not in scheduled,
+                    escalation=(issue_id, 'issue_escalation') not in scheduled
+                ))
+            return added
+
+
+def get_issue_with_creator(issue_id: int):
+    """Returns an issue with its creator's name and manager, or None."""
     with SessionLocal() as session:
+        row = session.execute(
+            select(Issue, User)
+            .outerjoin(User, User.user_id == Issue.created_by)
+            .where(Issue.id == issue_id)
+        ).first()
+
+        if not row:
+            return None
+
+        issue, creator = row
+        return {
+            'id': issue.id,
+            'title': issue.title,
+            'status': issue.status,
+            'created_at': issue.created_at,
+            'created_by': issue.created_by,
+            'creator_name': (creator.full_name or creator.first_name) if creator else None,
+            'manager_id': creator.manager_id if creator else None
+        }
+
+
+def set_issue_attachment(issue_id: int, attachment_type: str, file_id: str):
+    """Remember the file_id an issue's attachment was uploaded under."""
+    with SessionLocal() as session:
+        with session.begin():
+            issue = session.get(Issue, issue_id)
+            if issue:
+                issue.attachment_type = attachment_type
+                issue.attachment_file_id = file_id
+
+
+def get_open_issues(user_id: int = None):
+    """Get all open issues. Pass the viewing user's ID so they see their own recent changes."""
+    with read_session(user_id) as session:
         issues = session.query(Issue).filter(Issue.status == 'open').order_by(Issue.created_at.desc()).all()
         # Convert to dict to avoid detached instance issues
         return [{
@@ -109,22 +235,99 @@ def close_issue(issue_id: int, resolution: str, closed_by: int):
     """Close an issue with resolution."""
     with SessionLocal() as session:
         with session.begin():
-            issue = session.get(Issue, issue_id)
-            if issue:
+            issue = session.get(Issue, issue_id, with_for_update=True)
+            # Closing twice would count the issue twice in the statistics
+            if issue and issue.status != 'closed':
                 issue.status = 'closed'
                 issue.resolution = resolution
                 issue.closed_by = closed_by
                 issue.closed_at = func.now()
                 session.flush()
+                record_issue_closed(session, issue)
+                cancel_issue_jobs(session, issue_id)
+                pin_to_primary(closed_by)
                 return {
                     'id': issue.id,
                     'title': issue.title,
                     'message': issue.message,
-                    'resolution': resolution
+                    'resolution': resolution,
+                    'target_manager_id': issue.target_manager_id
                 }
     return None
 
 
+def _fts5_query(terms: str):
+    """Quotes every word so FTS5 treats user input as plain terms (implicit AND)."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in terms.split())
+
+
+def search_issues(terms: str, limit: int = SEARCH_PAGE_SIZE, offset: int = 0, user_id: int = None):
+    """
+    Full-text search over issue title, message and resolution, best match first.
+    Covers archived issues too. Uses the index created by models.init_search,
+    never a LIKE scan.
+    """
+    dialect_name = get_engine().dialect.name
+
+    if dialect_name == "postgresql":
+        matches = " UNION ALL ".join(
+            f"SELECT id, title, status, ts_rank_cd(search_vector, query) AS rank "
+            f"FROM {table}, websearch_to_tsquery(:config, :terms) AS query "
+            f"WHERE search_vector @@ query"
+            for table in SEARCHED_TABLES
+        )
+        query = text(f"{matches} ORDER BY rank DESC, id DESC LIMIT :limit OFFSET :offset")
+        params = {'config': SEARCH_CONFIG, 'terms': terms}
+    elif dialect_name == "sqlite":
+        matches = " UNION ALL ".join(
+            f"SELECT {table}.id AS id, {table}.title AS title, {table}.status AS status, "
+            f"bm25({table}_fts) AS rank "
+            f"FROM {table}_fts JOIN {table} ON {table}.id = {table}_fts.rowid "
+            f"WHERE {table}_fts MATCH :terms"
+            for table in SEARCHED_TABLES
+        )
+        query = text(f"{matches} ORDER BY rank, id DESC LIMIT :limit OFFSET :offset")
+        params = {'terms': _fts5_query(terms)}
+    else:
+        raise ValueError(f"Full-text search is not supported on {dialect_name}")
+
+    params.update(limit=limit, offset=offset)
+
+    with read_session(user_id) as session:
+        rows = session.execute(query, params).all()
+        return [{
+            'id': row.id,
+            'title': row.title,
+            'status': row.status
+        } for row in rows]
+
+
+def get_last_update_id():
+    """Returns the highest update ID already handled, or 0 if there is none."""
+    with SessionLocal() as session:
+        return session.scalar(select(func.max(ProcessedUpdate.update_id))) or 0
+
+
+def claim_updates(update_ids):
+    """
+    Records update IDs as handled and returns the ones that weren't already.
+    Anything not returned has been handled before and must be skipped.
+    """
+    with SessionLocal() as session:
+        with session.begin():
+            seen = set(session.scalars(
+                select(ProcessedUpdate.update_id).where(ProcessedUpdate.update_id.in_(update_ids))
+            ))
+            new_ids = [update_id for update_id in update_ids if update_id not in seen]
+            session.add_all(ProcessedUpdate(update_id=update_id) for update_id in new_ids)
+
+            # Keep the de-duplication index bounded
+            session.execute(delete(ProcessedUpdate).where(
+                ProcessedUpdate.update_id <= max(update_ids) - PROCESSED_UPDATES_KEEP
+            ))
+            return new_ids
+
+
 def update_last_seen(user_id: int):
     """Update user's last_seen timestamp."""
     with SessionLocal() as session:
@@ -134,6 +337,78 @@ def update_last_seen(user_id: int):
                 user.last_seen = func.now()
 
 
+# --- BROADCAST HELPERS ---
+
+def broadcast(user_ids, send):
+    """
+    Calls send(user_id) for every user, BROADCAST_WORKERS at a time.
+    Returns (success_count, fail_count).
+    """
+    success_count = 0
+    fail_count = 0
+
+    with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS) as pool:
+        futures = {pool.submit(send, uid): uid for uid in user_ids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                success_count += 1
+            except Exception as e:
+                fail_count += 1
+                print(f"Failed to send to {futures[future]}: {e}")
+
+    return success_count, fail_count
+
+
+def retry_on_flood(api_call, *args, **kwargs):
+    """
+    Calls a Bot API method, waiting and retrying when the server answers 429
+    (Too Many Requests) with a retry_after.
+    """
+    for attempt in range(FLOOD_RETRIES + 1):
+        try:
+            return api_call(*args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            if e.error_code != 429 or attempt == FLOOD_RETRIES:
+                raise
+            retry_after = ((e.result_json or {}).get('parameters') or {}).get('retry_after', 1)
+            time.sleep(retry_after)
+
+
+def send_issue_message(chat_id: int, text: str, attachment=None):
+    """
+    Sends an issue announcement, with its attachment if there is one.
+    `attachment` is an (attachment_type, file_id) pair.
+    """
+    if not attachment:
+        return retry_on_flood(bot.send_message, chat_id, text, parse_mode='Markdown')
+
+    attachment_type, file_id = attachment
+    send_file = bot.send_photo if attachment_type == 'photo' else bot.send_document
+
+    if len(text) <= CAPTION_LIMIT:
+        return retry_on_flood(send_file, chat_id, file_id, caption=text, parse_mode='Markdown')
+
+    # Too long for a caption: text first, then the file on its own
+    retry_on_flood(bot.send_message, chat_id, text, parse_mode='Markdown')
+    return retry_on_flood(send_file, chat_id, file_id)
+
+
+def get_sent_file_id(sent_message, attachment_type: str):
+    """Returns the file_id of the photo or document in a message the bot sent."""
+    if attachment_type == 'photo':
+        return sent_message.photo[-1].file_id
+    return sent_message.document.file_id
+
+
+def escape_markdown(text: str):
+    """
+    Escapes user-supplied text for parse_mode='Markdown'. Legacy Markdown only
+    treats _ * ` [ as markup (telebot.formatting.escape_markdown targets MarkdownV2).
+    """
+    return re.sub(r'([_*`\[])', r'\\\1', text)
+
+
 # --- KEYBOARD HELPERS ---
 
 def get_user_keyboard():
@@ -162,7 +437,6 @@ def get_admin_keyboard():
 
 # --- BOT HANDLERS ---
 
-@bot.message_handler(commands=['start'])
 def handle_start(message):
     user_id = message.chat.id
     first_name = message.from_user.first_name
@@ -192,7 +466,6 @@ def handle_start(message):
                      )
 
 
-@bot.message_handler(commands=['help'])
 def handle_help(message):
     user_id = message.chat.id
     update_last_seen(user_id)
@@ -209,8 +482,14 @@ def handle_help(message):
         help_text += """
 *Admin Commands:*
 /broadcast - Create and broadcast a new issue (multi-step)
+/broadcast <manager_id> - Broadcast only to people under that manager
 /issues - View all open issues
 /myissues - View issues you created
+/search <terms> - Search all issues, including closed ones
+/stats - Issue statistics
+/export [csv|jsonl] [open|closed] [since] [until] - Download issue history
+/schedule [daily] <time> <title> | <description> - Broadcast later
+/unschedule <job_id> - Cancel a scheduled broadcast
 
 💡 _Tip: Use the buttons below for quick access!_
 """
@@ -222,7 +501,6 @@ def handle_help(message):
     bot.reply_to(message, help_text, parse_mode='Markdown')
 
 
-@bot.message_handler(commands=['menu'])
 def handle_menu(message):
     """Show the keyboard menu."""
     user_id = message.chat.id
@@ -236,7 +514,6 @@ def handle_menu(message):
                  )
 
 
-@bot.message_handler(commands=['hide'])
 def handle_hide(message):
     """Hide the keyboard menu."""
     user_id = message.chat.id
@@ -251,7 +528,6 @@ def handle_hide(message):
                  )
 
 
-@bot.message_handler(commands=['broadcast'])
 def handle_broadcast(message):
     user_id = message.chat.id
     update_last_seen(user_id)
@@ -261,12 +537,28 @@ def handle_broadcast(message):
         bot.reply_to(message, "❌ You are not authorized to broadcast messages.")
         return
 
+    # Optional target: "/broadcast <manager_user_id>" only reaches that manager's reporting subtree.
+    # Any other text after the command is ignored, as before.
+    target_manager_id = None
+    args = message.text.split()[1:] if message.text.startswith('/') else []
+    if args and args[0].isdigit():
+        target_manager_id = int(args[0])
+
+        with SessionLocal() as session:
+            if not session.get(User, target_manager_id):
+                bot.reply_to(message, f"❌ User {target_manager_id} not found.")
+                return
+
+        if not get_subordinate_ids(target_manager_id):
+            bot.reply_to(message, f"❌ Nobody reports to user {target_manager_id}, so there is no one to send to.")
+            return
+
     # Start the multistep conversation
     msg = bot.reply_to(message, "📝 Please enter the *title* of the issue:", parse_mode='Markdown')
-    bot.register_next_step_handler(msg, process_issue_title, user_id)
+    bot.register_next_step_handler(msg, process_issue_title, user_id, target_manager_id)
 
 
-def process_issue_title(message, admin_id):
+def process_issue_title(message, admin_id, target_manager_id=None):
     """Process the issue title and ask for description."""
     title = message.text.strip()
 
@@ -276,22 +568,22 @@ def process_issue_title(message, admin_id):
 
     if len(title) < 3:
         msg = bot.reply_to(message, "❌ Title too short. Please enter a title (minimum 3 characters):")
-        bot.register_next_step_handler(msg, process_issue_title, admin_id)
+        bot.register_next_step_handler(msg, process_issue_title, admin_id, target_manager_id)
         return
 
     if len(title) > 255:
         msg = bot.reply_to(message, "❌ Title too long (maximum 255 characters). Please enter a shorter title:")
-        bot.register_next_step_handler(msg, process_issue_title, admin_id)
+        bot.register_next_step_handler(msg, process_issue_title, admin_id, target_manager_id)
         return
 
     # Ask for description
     msg = bot.reply_to(message, "✅ Title received!\n\n📝 Now please enter the *description* of the issue:",
                        parse_mode='Markdown')
-    bot.register_next_step_handler(msg, process_issue_description, admin_id, title)
+    bot.register_next_step_handler(msg, process_issue_description, admin_id, title, target_manager_id)
 
 
-def process_issue_description(message, admin_id, title):
-    """Process the issue description and create the issue."""
+def process_issue_description(message, admin_id, title, target_manager_id=None):
+    """Process the issue description and ask for an attachment."""
     description = message.text.strip()
 
     if description == "❌ Cancel":
@@ -300,11 +592,52 @@ def process_issue_description(message, admin_id, title):
 
     if len(description) < 10:
         msg = bot.reply_to(message, "❌ Description too short. Please provide more details (minimum 10 characters):")
-        bot.register_next_step_handler(msg, process_issue_description, admin_id, title)
+        bot.register_next_step_handler(msg, process_issue_description, admin_id, title, target_manager_id)
+        return
+
+    # Ask for an optional attachment
+    msg = bot.reply_to(message,
+                       "✅ Description received!\n\n"
+                       "📎 Send a photo or document (e.g. a floor plan or PDF procedure) to attach, "
+                       "or /skip to broadcast without one:")
+    bot.register_next_step_handler(msg, process_issue_attachment, admin_id, title, description, target_manager_id)
+
+
+def process_issue_attachment(message, admin_id, title, description, target_manager_id=None):
+    """Process the optional attachment, then create and broadcast the issue."""
+    if message.content_type == 'photo':
+        # The last size is the largest
+        attachment = ('photo', message.photo[-1].file_id)
+    elif message.content_type == 'document':
+        attachment = ('document', message.document.file_id)
+    elif message.text and message.text.strip() == "❌ Cancel":
+        bot.reply_to(message, "Cancelling...")
+        return
+    elif message.text and message.text.strip() in ('/skip', 'skip'):
+        attachment = None
+    else:
+        msg = bot.reply_to(message, "❌ Please send a photo or document, or /skip:")
+        bot.register_next_step_handler(msg, process_issue_attachment, admin_id, title, description, target_manager_id)
+        return
+
+    publish_issue(message.chat.id, admin_id, title, description, target_manager_id, attachment)
+
+
+def publish_issue(chat_id: int, admin_id: int, title: str, description: str,
+                  target_manager_id: int = None, attachment=None):
+    """
+    Creates an issue and broadcasts it, reporting progress to chat_id.
+    Used by the /broadcast conversation and by scheduled broadcasts.
+    """
+    users = get_issue_recipients(target_manager_id)
+
+    # The team may have been emptied since /broadcast or /schedule checked it
+    if target_manager_id is not None and not users:
+        bot.send_message(chat_id, f"❌ Nobody reports to user {target_manager_id}, so \"{title}\" was not broadcast.")
         return
 
     # Create issue in database
-    issue_id = create_issue(title, description, admin_id)
+    issue_id = create_issue(title, description, admin_id, target_manager_id)
     issue_ref = f"ISSUE-{issue_id:03d}"
 
     # Format the broadcast message
@@ -315,30 +648,48 @@ def process_issue_description(message, admin_id, title):
         f"_This issue will be tracked and resolved by our team._"
     )
 
-    users = get_all_users()
-    bot.reply_to(message, f"📤 Broadcasting to {len(users)} users...")
-
     success_count = 0
     fail_count = 0
 
-    for uid in users:
+    if attachment:
+        # Send to the admin first and reuse the file_id from that message for
+        # everyone else, so the file is uploaded once instead of once per user
         try:
-            bot.send_message(uid, broadcast_msg, parse_mode='Markdown')
-            success_count += 1
+            sent = send_issue_message(chat_id, broadcast_msg, attachment)
         except Exception as e:
-            fail_count += 1
-            print(f"Failed to send to {uid}: {e}")
-
-    bot.reply_to(message,
-                 f"✅ Broadcast complete!\n\n"
-                 f"Issue ID: {issue_ref}\n"
-                 f"Title: {title}\n"
-                 f"✓ Sent to: {success_count} users\n"
-                 f"✗ Failed: {fail_count} users"
-                 )
+            # The issue is already created, so broadcast anyway with the
+            # file_id the admin sent us rather than leave it unannounced
+            print(f"Failed to send attachment of {issue_ref} to {chat_id}: {e}")
+            bot.send_message(chat_id, f"⚠️ Couldn't send the attachment to you ({e}). "
+                                      f"Broadcasting with the original file...")
+        else:
+            attachment = (attachment[0], get_sent_file_id(sent, attachment[0]))
+
+            # The admin already has it
+            if chat_id in users:
+                users = [uid for uid in users if uid != chat_id]
+                success_count += 1
+
+        set_issue_attachment(issue_id, *attachment)
+
+    bot.send_message(chat_id, f"📤 Broadcasting to {len(users)} users...")
+
+    sent_count, failed_count = broadcast(
+        users,
+        lambda uid: send_issue_message(uid, broadcast_msg, attachment)
+    )
+    success_count += sent_count
+    fail_count += failed_count
+
+    bot.send_message(chat_id,
+                     f"✅ Broadcast complete!\n\n"
+                     f"Issue ID: {issue_ref}\n"
+                     f"Title: {title}\n"
+                     f"✓ Sent to: {success_count} users\n"
+                     f"✗ Failed: {fail_count} users"
+                     )
 
 
-@bot.message_handler(commands=['issues'])
 def handle_issues(message):
     user_id = message.chat.id
     update_last_seen(user_id)
@@ -348,7 +699,7 @@ def handle_issues(message):
         bot.reply_to(message, "❌ You are not authorized to view issues.")
         return
 
-    issues = get_open_issues()
+    issues = get_open_issues(user_id)
 
     if not issues:
         bot.reply_to(message, "✅ No open issues at the moment!")
@@ -375,7 +726,6 @@ def handle_issues(message):
     )
 
 
-@bot.message_handler(commands=['myissues'])
 def handle_my_issues(message):
     user_id = message.chat.id
     update_last_seen(user_id)
@@ -385,7 +735,7 @@ def handle_my_issues(message):
         bot.reply_to(message, "❌ You are not authorized to view issues.")
         return
 
-    with SessionLocal() as session:
+    with read_session(user_id) as session:
         issues = session.query(Issue).filter(
             Issue.created_by == user_id,
             Issue.status == 'open'
@@ -420,7 +770,258 @@ def handle_my_issues(message):
     )
 
 
-@bot.message_handler(commands=['cancel'])
+def build_search_page(terms: str, page: int, user_id: int = None):
+    """Returns the text and paging keyboard for one page of search results."""
+    # Fetch one extra row to know whether there is a next page without a COUNT(*)
+    results = search_issues(terms, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE, user_id=user_id)
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+
+    if not results:
+        return f"🔎 No issues found for: {escape_markdown(terms)}", None
+
+    lines = [f"🔎 *Search results for:* {escape_markdown(terms)}\n"]
+    for issue in results:
+        status_icon = "🟢" if issue['status'] == 'open' else "✅"
+        lines.append(f"{status_icon} ISSUE-{issue['id']:03d}: {escape_markdown(issue['title'])}")
+    lines.append(f"\n_Page {page + 1}_")
+
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(types.InlineKeyboardButton("« Previous", callback_data=f"search_page_{page - 1}"))
+    if has_next:
+        nav_buttons.append(types.InlineKeyboardButton("Next »", callback_data=f"search_page_{page + 1}"))
+    if nav_buttons:
+        markup.add(*nav_buttons)
+
+    return "\n".join(lines), markup
+
+
+def handle_search(message):
+    user_id = message.chat.id
+    update_last_seen(user_id)
+
+    # Check if user is admin
+    if not is_admin(user_id):
+        bot.reply_to(message, "❌ You are not authorized to search issues.")
+        return
+
+    terms = message.text.partition(' ')[2].strip()
+    if not terms:
+        bot.reply_to(message, "Usage: /search <terms>\n\nExample: /search printer third floor")
+        return
+
+    if get_engine().dialect.name not in SEARCH_DIALECTS:
+        bot.reply_to(message, "❌ Search is not available on this database.")
+        return
+
+    last_search_terms[user_id] = terms
+    search_text, markup = build_search_page(terms, 0, user_id)
+
+    bot.send_message(
+        message.chat.id,
+        search_text,
+        reply_markup=markup,
+        parse_mode='Markdown'
+    )
+
+
+def format_duration(seconds: float):
+    """Formats a duration like '2d 3h' or '45m'."""
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+
+def handle_stats(message):
+    user_id = message.chat.id
+    update_last_seen(user_id)
+
+    # Check if user is admin
+    if not is_admin(user_id):
+        bot.reply_to(message, "❌ You are not authorized to view statistics.")
+        return
+
+    stats = get_issue_stats(user_id=user_id)
+
+    mean_resolve = stats['mean_resolve_seconds']
+    mean_resolve_text = format_duration(mean_resolve) if mean_resolve is not None else "—"
+
+    lines = [
+        "📊 *Issue Statistics*\n",
+        f"*Open:* {stats['open']}",
+        f"*Closed:* {stats['closed']}",
+        f"*Total:* {stats['opened']}",
+        f"*Mean time to resolve:* {mean_resolve_text}\n",
+        f"*Last {stats['days']} days:* {stats['recent_opened']} opened, {stats['recent_closed']} closed",
+    ]
+
+    if stats['admins']:
+        lines.append("\n*Issues per admin:*")
+        for admin in stats['admins']:
+            lines.append(f"• {escape_markdown(admin['name'])}: {admin['opened']} opened, {admin['closed']} closed")
+
+    bot.reply_to(message, "\n".join(lines), parse_mode='Markdown')
+
+
+def handle_export(message):
+    # Only needed here, so regular startup doesn't pay for importing it
+    import tempfile
+    from export import export_issues, parse_date, EXPORT_FORMATS, EXPORT_STATUSES
+
+    user_id = message.chat.id
+    update_last_seen(user_id)
+
+    # Check if user is admin
+    if not is_admin(user_id):
+        bot.reply_to(message, "❌ You are not authorized to export issues.")
+        return
+
+    # Arguments may come in any order: a format, a status and up to two dates
+    fmt, status, dates = 'csv', None, []
+    for arg in message.text.split()[1:]:
+        if arg in EXPORT_FORMATS:
+            fmt = arg
+        elif arg in EXPORT_STATUSES:
+            status = arg
+        else:
+            try:
+                dates.append(parse_date(arg))
+            except ValueError:
+                dates = None
+                break
+
+    if dates is None or len(dates) > 2:
+        bot.reply_to(message,
+                     "Usage: /export [csv|jsonl] [open|closed] [since] [until]\n\n"
+                     "Dates are YYYY-MM-DD. Example: /export jsonl closed 2025-01-01 2025-12-31")
+        return
+
+    since = dates[0] if dates else None
+    until = dates[1] if len(dates) > 1 else None
+
+    bot.reply_to(message, "⏳ Preparing export...")
+
+    file_name = f"issues.{fmt}.gz"
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        row_count = export_issues(path, fmt, status, since, until)
+        with open(path, 'rb') as document:
+            bot.send_document(
+                message.chat.id,
+                document,
+                visible_file_name=file_name,
+                caption=f"📦 {row_count} issues exported"
+            )
+    finally:
+        os.remove(path)
+
+
+def parse_schedule_time(tokens):
+    """
+    Parses 'YYYY-MM-DD HH:MM' or 'HH:MM' (the next such time) from the start of tokens.
+    Returns (run_at, remaining tokens), or (None, tokens) if there is no time.
+    """
+    if len(tokens) >= 2:
+        try:
+            return datetime.strptime(f"{tokens[0]} {tokens[1]}", "%Y-%m-%d %H:%M"), tokens[2:]
+        except ValueError:
+            pass
+
+    if tokens:
+        try:
+            time_of_day = datetime.strptime(tokens[0], "%H:%M").time()
+        except ValueError:
+            return None, tokens
+
+        now = datetime.now()
+        run_at = datetime.combine(now.date(), time_of_day)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        return run_at, tokens[1:]
+
+    return None, tokens
+
+
+def handle_schedule(message):
+    user_id = message.chat.id
+    update_last_seen(user_id)
+
+    # Check if user is admin
+    if not is_admin(user_id):
+        bot.reply_to(message, "❌ You are not authorized to schedule broadcasts.")
+        return
+
+    # /schedule [daily] <time> <title> | <description>
+    head, _, description = message.text.partition('|')
+    tokens = head.split()[1:]
+
+    daily = bool(tokens) and tokens[0].lower() == 'daily'
+    if daily:
+        tokens = tokens[1:]
+
+    run_at, tokens = parse_schedule_time(tokens)
+    title = " ".join(tokens).strip()
+    description = description.strip()
+
+    if run_at is None or len(title) < 3 or len(title) > 255 or len(description) < 10:
+        bot.reply_to(message,
+                     "Usage: /schedule [daily] <time> <title> | <description>\n\n"
+                     "Time is HH:MM (next occurrence) or YYYY-MM-DD HH:MM.\n"
+                     "Example: /schedule 08:00 Fire drill | Everyone meets at the north exit at 8:15.")
+        return
+
+    if run_at <= datetime.now():
+        bot.reply_to(message, "❌ That time is in the past.")
+        return
+
+    with SessionLocal() as session:
+        with session.begin():
+            job = schedule_job(
+                session, 'broadcast', run_at,
+                payload={'admin_id': user_id, 'title': title, 'description': description},
+                interval_seconds=24 * 3600 if daily else None,
+                created_by=user_id
+            )
+            job_id = job.id
+
+    if scheduler:
+        scheduler.add(job_id, run_at)
+
+    repeat_text = " and every day after that" if daily else ""
+    bot.reply_to(message,
+                 f"🗓 Broadcast scheduled for {run_at.strftime('%Y-%m-%d %H:%M')}{repeat_text}.\n\n"
+                 f"Job ID: {job_id}. Use /unschedule {job_id} to cancel it.")
+
+
+def handle_unschedule(message):
+    user_id = message.chat.id
+    update_last_seen(user_id)
+
+    # Check if user is admin
+    if not is_admin(user_id):
+        bot.reply_to(message, "❌ You are not authorized to cancel scheduled broadcasts.")
+        return
+
+    try:
+        job_id = int(message.text.split()[1])
+    except (IndexError, ValueError):
+        bot.reply_to(message, "Usage: /unschedule <job_id>")
+        return
+
+    if cancel_job(job_id):
+        bot.reply_to(message, f"✅ Scheduled job {job_id} cancelled.")
+    else:
+        bot.reply_to(message, f"❌ Job {job_id} not found or already done.")
+
+
 def handle_cancel(message):
     user_id = message.chat.id
     update_last_seen(user_id)
@@ -428,7 +1029,6 @@ def handle_cancel(message):
 
 # --- CALLBACK QUERY HANDLERS (for inline buttons) ---
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('view_issue_'))
 def callback_view_issue(call):
     """Handle viewing issue details."""
     user_id = call.from_user.id
@@ -437,7 +1037,7 @@ def callback_view_issue(call):
     # Extract issue ID from callback data
     issue_id = int(call.data.split('_')[2])
 
-    with SessionLocal() as session:
+    with read_session(user_id) as session:
         issue = session.get(Issue, issue_id)
 
         if not issue:
@@ -484,7 +1084,6 @@ def callback_view_issue(call):
     bot.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('close_issue_'))
 def callback_close_issue(call):
     """Handle closing an issue - ask for resolution."""
     user_id = call.from_user.id
@@ -530,11 +1129,11 @@ def process_issue_resolution(message, issue_id, admin_id):
                  f"*ID:* ISSUE-{issue_id:03d}\n"
                  f"*Title:* {issue_data['title']}\n"
                  f"*Resolution:* {resolution}\n\n"
-                 f"Broadcasting resolution to all users...",
+                 f"Broadcasting resolution to everyone who received the issue...",
                  parse_mode='Markdown'
                  )
 
-    # Broadcast the resolution to all users
+    # Broadcast the resolution to the same people as the issue
     resolution_msg = (
         f"✅ *Issue Resolved: ISSUE-{issue_id:03d}*\n\n"
         f"*Title:*\n{issue_data['title']}\n\n"
@@ -543,15 +1142,11 @@ def process_issue_resolution(message, issue_id, admin_id):
         f"_This issue has been marked as closed._"
     )
 
-    users = get_all_users()
-    success_count = 0
-
-    for uid in users:
-        try:
-            bot.send_message(uid, resolution_msg, parse_mode='Markdown')
-            success_count += 1
-        except Exception as e:
-            print(f"Failed to send resolution to {uid}: {e}")
+    users = get_issue_recipients(issue_data['target_manager_id'])
+    success_count, _ = broadcast(
+        users,
+        lambda uid: retry_on_flood(bot.send_message, uid, resolution_msg, parse_mode='Markdown')
+    )
 
     bot.send_message(
         message.chat.id,
@@ -560,13 +1155,36 @@ def process_issue_resolution(message, issue_id, admin_id):
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == 'back_to_issues')
+def callback_search_page(call):
+    """Show another page of the last search."""
+    user_id = call.from_user.id
+    update_last_seen(user_id)
+
+    terms = last_search_terms.get(call.message.chat.id)
+    if not terms:
+        bot.answer_callback_query(call.id, "Search expired. Please run /search again.")
+        return
+
+    page = int(call.data.split('_')[2])
+    search_text, markup = build_search_page(terms, page, user_id)
+
+    bot.edit_message_text(
+        search_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=markup,
+        parse_mode='Markdown'
+    )
+
+    bot.answer_callback_query(call.id)
+
+
 def callback_back_to_issues(call):
     """Go back to issues list."""
     user_id = call.from_user.id
     update_last_seen(user_id)
 
-    issues = get_open_issues()
+    issues = get_open_issues(user_id)
 
     if not issues:
         bot.edit_message_text(
@@ -600,31 +1218,25 @@ def callback_back_to_issues(call):
 
 # --- KEYBOARD BUTTON HANDLERS ---
 
-@bot.message_handler(func=lambda message: message.text == "📋 Help" or message.text == "❓ Help")
 def button_help(message):
     handle_help(message)
 
-@bot.message_handler(func=lambda message: message.text == "❌ Cancel")
 def button_cancel(message):
     handle_cancel(message)
 
-@bot.message_handler(func=lambda message: message.text == "📢 Broadcast Issue")
 def button_broadcast(message):
     handle_broadcast(message)
 
 
-@bot.message_handler(func=lambda message: message.text == "📋 View Open Issues")
 def button_issues(message):
     handle_issues(message)
 
 
-@bot.message_handler(func=lambda message: message.text == "📝 My Issues")
 def button_my_issues(message):
     handle_my_issues(message)
 
 
 # Track all messages to update last_seen
-@bot.message_handler(func=lambda message: True)
 def handle_all_messages(message):
     """Catch-all handler for updating activity."""
     user_id = message.chat.id
@@ -635,18 +1247,193 @@ def handle_all_messages(message):
                  )
 
 
+# --- SCHEDULED JOBS ---
+
+def run_issue_reminder(payload, job):
+    """Reminds the creator that their issue is still open."""
+    issue = get_issue_with_creator(job['issue_id'])
+    if not issue or issue['status'] != 'open':
+        # Closed or archived before this feature existed; stop reminding
+        cancel_job(job['id'])
+        return
+
+    age = (datetime.now() - issue['created_at']).total_seconds()
+    bot.send_message(
+        issue['created_by'],
+        f"⏰ *Reminder:* ISSUE-{issue['id']:03d} has been open for {format_duration(age)}.\n\n"
+        f"*Title:* {escape_markdown(issue['title'])}\n\n"
+        f"Use /issues to close it once it is resolved.",
+        parse_mode='Markdown'
+    )
+
+
+def run_issue_escalation(payload, job):
+    """Tells the creator's manager (or the main admin) about an issue that has been open too long."""
+    issue = get_issue_with_creator(job['issue_id'])
+    if not issue or issue['status'] != 'open':
+        return
+
+    recipient = issue['manager_id'] or ADMIN_ID
+    if not recipient:
+        return
+
+    age = (datetime.now() - issue['created_at']).total_seconds()
+    bot.send_message(
+        recipient,
+        f"⚠️ *Escalation:* ISSUE-{issue['id']:03d} has been open for {format_duration(age)}.\n\n"
+        f"*Title:* {escape_markdown(issue['title'])}\n"
+        f"*Opened by:* {escape_markdown(issue['creator_name'] or str(issue['created_by']))}",
+        parse_mode='Markdown'
+    )
+
+
+def run_scheduled_broadcast(payload, job):
+    """Creates and broadcasts an issue scheduled with /schedule."""
+    publish_issue(
+        payload['admin_id'],
+        payload['admin_id'],
+        payload['title'],
+        payload['description'],
+        payload.get('target_manager_id')
+    )
+
+
+# --- APPLICATION FACTORY ---
+
+class BaleBot(telebot.TeleBot):
+    """
+    TeleBot that handles every update at most once, even across restarts.
+
+    Each batch from getUpdates is recorded in processed_updates before it is
+    dispatched, and updates that are already there are dropped. So a crash or
+    deploy never replays a step like creating and broadcasting an issue.
+    """
+
+    def __init__(self, token, updates_limit: int = None, **kwargs):
+        super().__init__(token, **kwargs)
+        # Max updates per getUpdates round trip (the Bot API allows 1-100)
+        self.updates_limit = updates_limit
+
+    def get_updates(self, offset=None, limit=None, *args, **kwargs):
+        return super().get_updates(offset, limit or self.updates_limit, *args, **kwargs)
+
+    def process_new_updates(self, updates):
+        if not updates:
+            return
+
+        # If claiming fails, the offset stays put and the batch is fetched again
+        new_ids = set(claim_updates([update.update_id for update in updates]))
+
+        # Advance the offset past the whole batch, including skipped duplicates
+        self.last_update_id = max(self.last_update_id, max(update.update_id for update in updates))
+
+        skipped = len(updates) - len(new_ids)
+        if skipped:
+            print(f"Skipped {skipped} already processed updates")
+
+        super().process_new_updates([update for update in updates if update.update_id in new_ids])
+
+
+def create_bot(token: str = None, threaded: bool = True):
+    """
+    Builds the bot and registers every handler.
+    Nothing here touches the network or the database; that happens when the
+    first update is handled.
+    """
+    global bot, scheduler, BOT_TOKEN, ADMIN_ID, POLL_LIMIT, POLL_TIMEOUT, BROADCAST_WORKERS
+    global REMINDER_AFTER_HOURS, REMINDER_INTERVAL_HOURS, ESCALATE_AFTER_HOURS
+
+    load_dotenv()  # Take environment variables from .env.
+
+    BOT_TOKEN = token or os.getenv('BOT_TOKEN')
+
+    # Get admin ID from environment
+    try:
+        ADMIN_ID = int(os.getenv('ADMIN_ID'))
+    except (ValueError, TypeError):
+        print("Warning: ADMIN_ID not set or invalid. Broadcast functionality will be disabled.")
+        ADMIN_ID = None
+
+    # Long polling: updates per getUpdates call and how long the server may hold it open
+    POLL_LIMIT = int(os.getenv('POLL_LIMIT', 100))
+    POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', 20))
+
+    BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 8))
+
+    REMINDER_AFTER_HOURS = float(os.getenv('REMINDER_AFTER_HOURS', 24))
+    REMINDER_INTERVAL_HOURS = float(os.getenv('REMINDER_INTERVAL_HOURS', 24))
+    ESCALATE_AFTER_HOURS = float(os.getenv('ESCALATE_AFTER_HOURS', 72))
+
+    # CRITICAL STEP: Override the server URL to point to Baleh
+    apihelper.API_URL = "https://tapi.bale.ai/bot{0}/{1}"
+
+    bot = BaleBot(BOT_TOKEN, updates_limit=POLL_LIMIT, threaded=threaded)
+
+    # Order matters: the first matching handler wins, so the catch-all goes last
+    bot.register_message_handler(handle_start, commands=['start'])
+    bot.register_message_handler(handle_help, commands=['help'])
+    bot.register_message_handler(handle_menu, commands=['menu'])
+    bot.register_message_handler(handle_hide, commands=['hide'])
+    bot.register_message_handler(handle_broadcast, commands=['broadcast'])
+    bot.register_message_handler(handle_issues, commands=['issues'])
+    bot.register_message_handler(handle_my_issues, commands=['myissues'])
+    bot.register_message_handler(handle_search, commands=['search'])
+    bot.register_message_handler(handle_stats, commands=['stats'])
+    bot.register_message_handler(handle_export, commands=['export'])
+    bot.register_message_handler(handle_schedule, commands=['schedule'])
+    bot.register_message_handler(handle_unschedule, commands=['unschedule'])
+    bot.register_message_handler(handle_cancel, commands=['cancel'])
+    bot.register_callback_query_handler(callback_view_issue, func=lambda call: call.data.startswith('view_issue_'))
+    bot.register_callback_query_handler(callback_close_issue, func=lambda call: call.data.startswith('close_issue_'))
+    bot.register_callback_query_handler(callback_search_page, func=lambda call: call.data.startswith('search_page_'))
+    bot.register_callback_query_handler(callback_back_to_issues, func=lambda call: call.data == 'back_to_issues')
+    bot.register_message_handler(button_help, func=lambda message: message.text == "📋 Help" or message.text == "❓ Help")
+    bot.register_message_handler(button_cancel, func=lambda message: message.text == "❌ Cancel")
+    bot.register_message_handler(button_broadcast, func=lambda message: message.text == "📢 Broadcast Issue")
+    bot.register_message_handler(button_issues, func=lambda message: message.text == "📋 View Open Issues")
+    bot.register_message_handler(button_my_issues, func=lambda message: message.text == "📝 My Issues")
+    bot.register_message_handler(handle_all_messages, func=lambda message: True)
+
+    # Started separately (see __main__), since loading pending jobs needs the database
+    scheduler = Scheduler()
+    scheduler.register('issue_reminder', run_issue_reminder)
+    scheduler.register('issue_escalation', run_issue_escalation)
+    scheduler.register('broadcast', run_scheduled_broadcast)
+
+    return bot
+
+
 # --- MAIN LOOP ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Baleh office automation bot.")
+    parser.add_argument('--init-db', action='store_true',
+                        help="create missing tables and search indexes before starting")
+    parser.add_argument('--backfill-reminders', action='store_true',
+                        help="schedule reminders and escalations for open issues that predate them")
+    args = parser.parse_args()
+
+    create_bot()
+
     print("🤖 Bale Bot Started...")
     print(f"Admin ID: {ADMIN_ID}")
 
-    # Initialize database tables if they don't exist
-    try:
-        init_db()
-    except Exception as e:
-        print(f"Database initialization note: {e}")
+    # Schema changes are opt-in, so a normal restart doesn't pay for them
+    if args.init_db:
+        try:
+            init_db()
+        except Exception as e:
+            print(f"Database initialization note: {e}")
+
+    # Before scheduler.start(), which loads every pending job
+    if args.backfill_reminders:
+        print(f"Scheduled {backfill_issue_jobs()} reminders/escalations for existing open issues")
+
+    # Resume after the last update handled before the restart
+    bot.last_update_id = get_last_update_id()
+
+    scheduler.start()
 
     try:
-        bot.infinity_polling()
+        bot.infinity_polling(timeout=POLL_TIMEOUT, long_polling_timeout=POLL_TIMEOUT)
     except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        print(f"Error: {e}")
@@ -0,0 +1,120 @@
+"""
+Cold-start benchmark for the bot.
+
+Measures two things, each in a fresh interpreter:
+  1. Import time of bale_bot, as reported by `python -X importtime`.
+  2. Time from process start to the first handled update: import, create_bot(),
+     then a /help update processed end to end against a throwaway SQLite
+     database. Bot API calls are answered locally, so no network is involved.
+
+Usage:
+    python bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROCESS_START = time.perf_counter()
+
+BENCH_TOKEN = "123456:bench"
+BENCH_USER_ID = 1
+
+
+def measure_import_time():
+    """Returns the cumulative import time of bale_bot in milliseconds."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import bale_bot"],
+        capture_output=True, text=True, check=True, env=os.environ.copy()
+    )
+    for line in completed.stderr.splitlines():
+        # Format: "import time: <self us> | <cumulative us> | <module>"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == "bale_bot":
+            return int(parts[1]) / 1000
+    raise RuntimeError("bale_bot not found in -X importtime output")
+
+
+def measure_first_update():
+    """Returns the time to the first handled update in milliseconds."""
+    completed = subprocess.run(
+        [sys.executable, __file__, "--first-update"],
+        capture_output=True, text=True, check=True, env=os.environ.copy()
+    )
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+class FakeResponse:
+    """Just enough of requests.Response for telebot's result checking."""
+    status_code = 200
+
+    def __init__(self, result):
+        self.text = json.dumps({'ok': True, 'result': result})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def fake_request_sender(method, url, **kwargs):
+    """Answers every Bot API call with a minimal sent message."""
+    return FakeResponse({
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': BENCH_USER_ID, 'type': 'private'}
+    })
+
+
+def run_first_update():
+    """Child process: import, build the bot, handle one /help update, print elapsed ms."""
+    import bale_bot
+    from telebot import apihelper, types
+
+    bot = bale_bot.create_bot(BENCH_TOKEN, threaded=False)
+    apihelper.CUSTOM_REQUEST_SENDER = fake_request_sender
+
+    update = types.Update.de_json({
+        # Fresh ID every run, otherwise the bot would skip it as already processed
+        'update_id': time.time_ns() // 1000,
+        'message': {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': BENCH_USER_ID, 'type': 'private'},
+            'from': {'id': BENCH_USER_ID, 'is_bot': False, 'first_name': 'Bench'},
+            'text': '/help',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}]
+        }
+    })
+    bot.process_new_updates([update])
+
+    print(f"{(time.perf_counter() - PROCESS_START) * 1000:.1f}")
+
+
+def report(name, samples):
+    print(f"{name:<28} median {statistics.median(samples):8.1f} ms   "
+          f"min {min(samples):8.1f} ms   max {max(samples):8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure bot cold-start time.")
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes per measurement (default 5)")
+    parser.add_argument('--first-update', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.first_update:
+        run_first_update()
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['BOT_TOKEN'] = BENCH_TOKEN
+
+        # Schema setup is not part of a normal start, so do it once up front
+        from models import init_db
+        init_db()
+
+        report("import bale_bot", [measure_import_time() for _ in range(args.runs)])
+        report("first handled update", [measure_first_update() for _ in range(args.runs)])
@@ -0,0 +1,131 @@
+"""
+Streams issues (live and archived) to a gzip-compressed CSV or JSONL file.
+
+Rows are read from the read replica (if configured) through a server-side
+cursor in chunks and written out as they arrive, never loaded into the ORM, so
+memory stays flat however large the export is.
+
+Usage:
+    python export.py issues.csv.gz
+    python export.py issues.jsonl.gz --format jsonl --status closed --since 2025-01-01 --until 2025-12-31
+"""
+import argparse
+import csv
+import gzip
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+
+from models import get_replica_engine, Issue, ArchivedIssue, User
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_STATUSES = ('open', 'closed')
+
+# Rows fetched from the server-side cursor per round trip
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_COLUMNS = [
+    'id', 'title', 'message', 'status',
+    'created_at', 'created_by', 'created_by_name',
+    'closed_at', 'closed_by', 'closed_by_name', 'resolution'
+]
+
+
+def build_export_query(model, status: str = None, since: date = None, until: date = None):
+    """
+    Select for one issues-shaped table with creator and closer names.
+    `since` and `until` filter on the creation date and are both inclusive.
+    """
+    creator = aliased(User)
+    closer = aliased(User)
+
+    query = (
+        select(
+            model.id,
+            model.title,
+            model.message,
+            model.status,
+            model.created_at,
+            model.created_by,
+            func.coalesce(creator.full_name, creator.first_name).label('created_by_name'),
+            model.closed_at,
+            model.closed_by,
+            func.coalesce(closer.full_name, closer.first_name).label('closed_by_name'),
+            model.resolution
+        )
+        .outerjoin(creator, creator.user_id == model.created_by)
+        .outerjoin(closer, closer.user_id == model.closed_by)
+        .order_by(model.id)
+    )
+
+    if status:
+        query = query.where(model.status == status)
+    if since:
+        query = query.where(model.created_at >= datetime.combine(since, datetime.min.time()))
+    if until:
+        query = query.where(model.created_at < datetime.combine(until + timedelta(days=1), datetime.min.time()))
+
+    return query
+
+
+def _json_value(value):
+    """Makes datetimes JSON serialisable."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def export_issues(path: str, fmt: str = 'csv', status: str = None, since: date = None, until: date = None):
+    """
+    Writes matching issues to a gzip file at `path`. Archived issues come
+    first, then live ones, each in ID order. Returns the number of rows written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    # Archived issues are all closed, so an open-only export can skip them
+    models = [Issue] if status == 'open' else [ArchivedIssue, Issue]
+    row_count = 0
+
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as out, get_replica_engine().connect() as conn:
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(EXPORT_COLUMNS)
+
+        streaming = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+
+        for model in models:
+            result = streaming.execute(build_export_query(model, status, since, until))
+
+            for chunk in result.partitions():
+                if fmt == 'csv':
+                    writer.writerows(chunk)
+                else:
+                    out.writelines(
+                        json.dumps({name: _json_value(value) for name, value in zip(EXPORT_COLUMNS, row)},
+                                   ensure_ascii=False) + "\n"
+                        for row in chunk
+                    )
+                row_count += len(chunk)
+
+    return row_count
+
+
+def parse_date(value: str):
+    """Parses a YYYY-MM-DD date."""
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export issues to a gzip-compressed CSV or JSONL file.")
+    parser.add_argument('output', help="output file, e.g. issues.csv.gz")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--status', choices=EXPORT_STATUSES, help="only export open or closed issues")
+    parser.add_argument('--since', type=parse_date, help="created on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--until', type=parse_date, help="created on or before this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    exported = export_issues(args.output, args.format, args.status, args.since, args.until)
+    print(f"✅ Exported {exported} issues to {args.output}")
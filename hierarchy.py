@@ -0,0 +1,146 @@
+"""
+Reporting hierarchy backed by a closure table.
+
+`user_hierarchy` stores one row per (ancestor, descendant) pair of the org
+chart, including each user paired with themselves at depth 0. Everyone under a
+manager is then one indexed query, however deep or wide the subtree is.
+
+init_db() builds the table from users.manager_id when it is created, and
+set_manager() keeps it up to date when a single manager_id changes. After a
+bulk directory import, rebuild it from users.manager_id:
+    python hierarchy.py --rebuild
+"""
+import argparse
+
+from sqlalchemy import select, insert, delete, update, func, literal, true
+from sqlalchemy.orm import aliased
+
+from models import SessionLocal, ReadSessionLocal, User, UserHierarchy
+
+# Guards the recursive queries against manager_id cycles in imported data
+MAX_HIERARCHY_DEPTH = 50
+
+
+def _subtree_cte():
+    """
+    Recursive CTE of (ancestor_id, user_id, depth) rows following manager_id
+    downwards from every user.
+    """
+    roots = select(User.user_id.label('ancestor_id'), User.user_id, literal(0).label('depth'))
+    tree = roots.cte('subtree', recursive=True)
+    return tree.union_all(
+        select(tree.c.ancestor_id, User.user_id, tree.c.depth + 1)
+        .join(tree, User.manager_id == tree.c.user_id)
+        .where(tree.c.depth < MAX_HIERARCHY_DEPTH)
+    )
+
+
+def add_to_hierarchy(session, user_id: int):
+    """Adds the depth-0 row for a new user. Call in the transaction that creates the user."""
+    session.add(UserHierarchy(ancestor_id=user_id, descendant_id=user_id, depth=0))
+
+
+def _ensure_in_hierarchy(session, user_ids):
+    """Adds depth-0 rows for users added without add_to_hierarchy (e.g. by a bulk import)."""
+    existing = set(session.scalars(
+        select(UserHierarchy.descendant_id)
+        .where(UserHierarchy.descendant_id.in_(user_ids), UserHierarchy.depth == 0)
+    ))
+    for user_id in set(user_ids) - existing:
+        add_to_hierarchy(session, user_id)
+    session.flush()
+
+
+def set_manager(session, user_id: int, manager_id: int = None):
+    """
+    Moves a user (with everyone under them) to a new manager, or to the top
+    level if manager_id is None. Updates users.manager_id and the closure table
+    in the caller's transaction.
+    """
+    if manager_id == user_id:
+        raise ValueError("A user cannot be their own manager")
+
+    _ensure_in_hierarchy(session, [user_id] if manager_id is None else [user_id, manager_id])
+
+    if manager_id is not None:
+        manages_new_manager = session.scalar(
+            select(UserHierarchy.depth)
+            .where(UserHierarchy.ancestor_id == user_id, UserHierarchy.descendant_id == manager_id)
+        )
+        if manages_new_manager is not None:
+            raise ValueError(f"User {manager_id} reports to {user_id}; that would create a cycle")
+
+    # Cut the subtree loose from its old ancestors
+    old_ancestors = list(session.scalars(
+        select(UserHierarchy.ancestor_id)
+        .where(UserHierarchy.descendant_id == user_id, UserHierarchy.depth > 0)
+    ))
+    if old_ancestors:
+        subtree = select(UserHierarchy.descendant_id).where(UserHierarchy.ancestor_id == user_id)
+        session.execute(
+            delete(UserHierarchy)
+            .where(UserHierarchy.ancestor_id.in_(old_ancestors), UserHierarchy.descendant_id.in_(subtree))
+        )
+
+    # Connect every ancestor of the new manager to every member of the subtree
+    if manager_id is not None:
+        above = aliased(UserHierarchy)
+        below = aliased(UserHierarchy)
+        session.execute(
+            insert(UserHierarchy).from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+                .select_from(above)
+                .join(below, true())
+                .where(above.descendant_id == manager_id, below.ancestor_id == user_id)
+            )
+        )
+
+    session.execute(update(User).where(User.user_id == user_id).values(manager_id=manager_id))
+
+
+def get_subordinate_ids(manager_id: int):
+    """Returns the IDs of everyone who reports to manager_id, directly or indirectly."""
+    with ReadSessionLocal() as session:
+        return list(session.scalars(
+            select(UserHierarchy.descendant_id)
+            .where(UserHierarchy.ancestor_id == manager_id, UserHierarchy.depth > 0)
+        ))
+
+
+def rebuild_hierarchy(if_empty: bool = False):
+    """
+    Rebuilds user_hierarchy from users.manager_id in one transaction.
+    With if_empty, leaves a table that already has rows alone (used by init_db).
+    Returns the number of rows written, or None if nothing was done.
+    """
+    tree = _subtree_cte()
+
+    with SessionLocal() as session:
+        with session.begin():
+            if if_empty and session.scalar(select(UserHierarchy.ancestor_id).limit(1)) is not None:
+                return None
+
+            session.execute(delete(UserHierarchy))
+            session.execute(
+                insert(UserHierarchy).from_select(
+                    ['ancestor_id', 'descendant_id', 'depth'],
+                    # A manager_id cycle reaches the same pair more than once; keep the shortest path
+                    select(tree.c.ancestor_id, tree.c.user_id, func.min(tree.c.depth))
+                    .group_by(tree.c.ancestor_id, tree.c.user_id)
+                )
+            )
+            return session.scalar(select(func.count()).select_from(UserHierarchy))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reporting hierarchy maintenance.")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="rebuild user_hierarchy from users.manager_id (run after a directory import)")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        written = rebuild_hierarchy()
+        print(f"✅ Rebuilt reporting hierarchy ({written} rows).")
+    else:
+        parser.print_help()
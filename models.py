@@ -2,22 +2,93 @@
 from __future__ import annotations
 
 import os
+import time
+import threading
 from dotenv import load_dotenv
 
 from typing import List, Optional
 
-from sqlalchemy import create_engine, Column, String, BigInteger, DateTime, ForeignKey, func, Integer, Text
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
+from sqlalchemy import create_engine, Column, String, BigInteger, Date, DateTime, ForeignKey, func, Integer, Text, Index, inspect, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, Session
 
-from datetime import datetime
+from datetime import date, datetime
 
-load_dotenv()  # Take environment variables from .env.
-
-database_url = os.getenv('DATABASE_URL')
 
 # --- DATABASE CONNECTION SETUP ---
-DATABASE_URL = database_url
-engine = create_engine(DATABASE_URL)
+# Engines are created on first use, not at import time, so importing the
+# models (from the bot, tools or Alembic) never reads .env or opens a pool.
+_engine = None
+_replica_engine = None
+
+# How long a user's reads stay on the primary after they write, to ride out replica lag
+PRIMARY_PIN_SECONDS = 10
+
+# user_id -> time.monotonic() of their last pinned write. Handler, broadcast and
+# scheduler threads all touch it, so every access holds _recent_writers_lock.
+_recent_writers = {}
+_recent_writers_lock = threading.Lock()
+
+
+def get_engine():
+    """Returns the shared primary engine, creating it from DATABASE_URL on first call."""
+    global _engine
+    if _engine is None:
+        load_dotenv()  # Take environment variables from .env.
+        _engine = create_engine(os.getenv('DATABASE_URL'))
+    return _engine
+
+
+def get_replica_engine():
+    """
+    Returns the read-replica engine from DATABASE_REPLICA_URL, or the primary
+    engine if no replica is configured.
+    """
+    global _replica_engine
+    if _replica_engine is None:
+        load_dotenv()
+        replica_url = os.getenv('DATABASE_REPLICA_URL')
+        _replica_engine = create_engine(replica_url) if replica_url else get_engine()
+    return _replica_engine
+
+
+class LazySession(Session):
+    """
+    Session that looks up its engine when it first runs a query.
+    Sessions created with info={'read_only': True} go to the read replica.
+    """
+
+    def get_bind(self, mapper=None, **kwargs):
+        if self.info.get('read_only'):
+            return get_replica_engine()
+        return get_engine()
+
+
+SessionLocal = sessionmaker(class_=LazySession)
+ReadSessionLocal = sessionmaker(class_=LazySession, info={'read_only': True})
+
+
+def pin_to_primary(user_id: int):
+    """Sends the user's reads to the primary for a while, so they see what they just wrote."""
+    now = time.monotonic()
+    with _recent_writers_lock:
+        _recent_writers[user_id] = now
+
+        # Forget pins that have expired, so the dict stays small
+        if len(_recent_writers) > 1000:
+            for expired in [uid for uid, written_at in _recent_writers.items() if now - written_at >= PRIMARY_PIN_SECONDS]:
+                del _recent_writers[expired]
+
+
+def read_session(user_id: int = None):
+    """
+    Session for read-only queries: the replica, unless user_id wrote
+    something recently (see pin_to_primary).
+    """
+    with _recent_writers_lock:
+        written_at = _recent_writers.get(user_id)
+    if written_at is not None and time.monotonic() - written_at < PRIMARY_PIN_SECONDS:
+        return SessionLocal()
+    return ReadSessionLocal()
 
 
 # Define the base class for models
@@ -66,6 +137,12 @@ class Issue(Base):
     Each issue gets a unique ID for reference and can be closed by admins.
     """
     __tablename__ = 'issues'
+    __table_args__ = (
+        # Serves get_open_issues() and the archiver's scan for old closed issues
+        Index('ix_issues_status_closed_at', 'status', 'closed_at'),
+        # Never reuse an ID once the newest issue has been archived (SQLite only)
+        {'sqlite_autoincrement': True},
+    )
 
     # Auto-incrementing ID for issues (like ISSUE-001, ISSUE-002, etc.)
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -91,6 +168,15 @@ class Issue(Base):
     # Telegram message ID for tracking (optional, for editing/deleting)
     telegram_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
+    # Optional photo/document sent with the issue: 'photo' or 'document', plus
+    # the Bale file_id it was uploaded under, reused for every recipient
+    attachment_type: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    attachment_file_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+
+    # Set when the issue was only broadcast to one manager's reporting subtree,
+    # so the resolution goes to the same people
+    target_manager_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
     # Relationships
     creator = relationship("User", foreign_keys=[created_by], backref="created_issues")
     closer = relationship("User", foreign_keys=[closed_by], backref="closed_issues")
@@ -103,9 +189,248 @@ class Issue(Base):
         return f"ISSUE-{self.id:03d}"
 
 
+class ArchivedIssue(Base):
+    """
+    Cold storage for issues closed long ago (see archive.py).
+    Same columns as Issue, and rows keep their original ID, so ISSUE-001
+    still means the same issue after it has been archived.
+    """
+    __tablename__ = 'issues_archive'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+
+    title: Mapped[str] = mapped_column(String(255))
+    message: Mapped[str] = mapped_column(Text)
+    created_by: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.user_id"))
+    status: Mapped[str] = mapped_column(String(20), server_default="closed")
+    created_at: Mapped[datetime] = mapped_column()
+
+    resolution: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    closed_by: Mapped[Optional[int]] = mapped_column(BigInteger, ForeignKey("users.user_id"), nullable=True)
+    closed_at: Mapped[Optional[datetime]] = mapped_column(nullable=True, index=True)
+
+    telegram_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    attachment_type: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    attachment_file_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    target_manager_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+    # When the row was moved out of the issues table
+    archived_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    def __repr__(self):
+        return f"ArchivedIssue(id={self.id!r}, closed_at={self.closed_at!r})"
+
+
+class UserHierarchy(Base):
+    """
+    Closure table of the manager hierarchy (see hierarchy.py).
+    One row per (ancestor, descendant) pair, including every user paired with
+    themselves at depth 0, so a whole reporting subtree is a single lookup.
+    """
+    __tablename__ = 'user_hierarchy'
+
+    ancestor_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True, index=True)
+
+    # 0 for the user themselves, 1 for direct reports, and so on
+    depth: Mapped[int] = mapped_column(Integer)
+
+    def __repr__(self):
+        return f"UserHierarchy(ancestor={self.ancestor_id!r}, descendant={self.descendant_id!r}, depth={self.depth!r})"
+
+
+class ProcessedUpdate(Base):
+    """
+    Bot API updates that have already been handled.
+    The highest update_id is where polling resumes after a restart, and the
+    recent IDs let the bot drop updates that are delivered a second time.
+    Old rows are pruned, so the table stays small.
+    """
+    __tablename__ = 'processed_updates'
+
+    update_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    processed_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    def __repr__(self):
+        return f"ProcessedUpdate(update_id={self.update_id!r})"
+
+
+class ScheduledJob(Base):
+    """
+    A persisted timer run by scheduler.Scheduler: issue reminders, escalations
+    and scheduled broadcasts. Recurring jobs move run_at forward each time they
+    fire; one-shot jobs are marked done.
+    """
+    __tablename__ = 'scheduled_jobs'
+    __table_args__ = (
+        # Loading pending jobs at startup
+        Index('ix_scheduled_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+
+    # Which handler runs it, e.g. 'issue_reminder' or 'broadcast'
+    kind: Mapped[str] = mapped_column(String(50))
+    run_at: Mapped[datetime] = mapped_column()
+
+    # Set for recurring jobs
+    interval_seconds: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    # JSON arguments for the handler
+    payload: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    # The issue a reminder/escalation is about, so closing it can cancel them.
+    # No foreign key: the issue may be archived later.
+    issue_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+
+    # 'pending', 'done' or 'cancelled'
+    status: Mapped[str] = mapped_column(String(20), server_default="pending")
+
+    created_by: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    def __repr__(self):
+        return f"ScheduledJob(id={self.id!r}, kind={self.kind!r}, run_at={self.run_at!r}, status={self.status!r})"
+
+
+class IssueStats(Base):
+    """
+    Issue counters per day and per creating admin (see stats.py).
+    Updated in the same transaction as create_issue/close_issue, so /stats
+    never has to scan the issues table.
+    """
+    __tablename__ = 'issue_stats'
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    created_by: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.user_id"), primary_key=True)
+
+    # Issues created on this day / closed on this day
+    opened_count: Mapped[int] = mapped_column(Integer, server_default="0")
+    closed_count: Mapped[int] = mapped_column(Integer, server_default="0")
+
+    # Sum of (closed_at - created_at) for issues closed on this day
+    resolve_seconds: Mapped[int] = mapped_column(BigInteger, server_default="0")
+
+    def __repr__(self):
+        return f"IssueStats(day={self.day!r}, created_by={self.created_by!r})"
+
+
+# --- FULL-TEXT SEARCH ---
+
+# 'simple' does no stemming or stop-word removal, so Persian and English text
+# are indexed the same way.
+SEARCH_CONFIG = "simple"
+
+
+def _search_ddl(dialect_name: str, table: str):
+    """
+    Returns the statements that add a full-text index over title, message and
+    resolution of an issues-shaped table.
+
+    Postgres gets a generated tsvector column with a GIN index. SQLite gets an
+    external-content FTS5 table kept in sync by triggers.
+    """
+    if dialect_name == "postgresql":
+        return [
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(message, '')), 'B') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(resolution, '')), 'C')"
+            f") STORED",
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING gin (search_vector)",
+        ]
+
+    if dialect_name == "sqlite":
+        fts = f"{table}_fts"
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"title, message, resolution, content='{table}', content_rowid='id')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, title, message, resolution) "
+            f"VALUES (new.id, new.title, new.message, new.resolution); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, title, message, resolution) "
+            f"VALUES ('delete', old.id, old.title, old.message, old.resolution); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, title, message, resolution) "
+            f"VALUES ('delete', old.id, old.title, old.message, old.resolution); "
+            f"INSERT INTO {fts}(rowid, title, message, resolution) "
+            f"VALUES (new.id, new.title, new.message, new.resolution); END",
+        ]
+
+    return []
+
+
+def init_search(bind, table: str = "issues"):
+    """Creates the full-text index for a table if it is missing. Safe to run on every boot."""
+    with bind.begin() as conn:
+        dialect_name = conn.dialect.name
+        # An FTS5 table created after rows already exist starts out empty.
+        needs_rebuild = dialect_name == "sqlite" and not inspect(conn).has_table(f"{table}_fts")
+
+        for statement in _search_ddl(dialect_name, table):
+            conn.execute(text(statement))
+
+        if needs_rebuild:
+            conn.execute(text(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')"))
+
+
+def add_missing_columns(bind):
+    """
+    Adds nullable columns that were added to the models after their table was
+    created. create_all() only creates whole tables, never new columns.
+    """
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                print(f"Added column {table.name}.{column.name}")
+
+
+def add_missing_indexes(bind):
+    """
+    Creates model indexes missing from tables that already existed.
+    create_all() skips existing tables together with their indexes.
+    """
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                index.create(conn)
+                print(f"Added index {index.name} on {table.name}")
+
+
 def init_db():
     """Creates all tables in the database."""
+    engine = get_engine()
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+    init_search(engine, "issues")
+    init_search(engine, "issues_archive")
+
+    # The closure table is only trustworthy once it has been built from
+    # users.manager_id, so build it as soon as it is created
+    from hierarchy import rebuild_hierarchy
+    written = rebuild_hierarchy(if_empty=True)
+    if written is not None:
+        print(f"Built reporting hierarchy ({written} rows)")
+
     print("✅ Database tables created successfully.")
 
 
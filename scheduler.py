@@ -0,0 +1,227 @@
+"""
+Timer scheduler for reminders, escalations and scheduled broadcasts.
+
+Jobs live in the `scheduled_jobs` table, so they survive restarts. The bot
+process keeps their due times in an in-memory min-heap, and one thread sleeps
+until the earliest one. The database is only touched when a job is due or
+added, never polled.
+
+Before a job runs it is claimed with a compare-and-set on (status, run_at).
+A job therefore fires at most once, even with stale heap entries or after a
+restart in the middle of a run.
+"""
+import heapq
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from models import SessionLocal, ScheduledJob
+
+# Jobs that run at the same time (a long broadcast doesn't hold up reminders)
+SCHEDULER_WORKERS = 4
+
+# Pending jobs read per round trip when loading at startup
+LOAD_CHUNK_SIZE = 5000
+
+# How long to wait before trying again when a job can't be claimed (e.g. the
+# database is briefly unavailable)
+CLAIM_RETRY_SECONDS = 30
+
+
+def schedule_job(session, kind: str, run_at: datetime, payload: dict = None,
+                 interval_seconds: int = None, issue_id: int = None, created_by: int = None):
+    """
+    Adds a job in the caller's transaction and returns it. After committing,
+    pass it to Scheduler.add() so the running scheduler knows about it.
+    """
+    job = ScheduledJob(
+        kind=kind,
+        run_at=run_at,
+        payload=json.dumps(payload) if payload is not None else None,
+        interval_seconds=interval_seconds,
+        issue_id=issue_id,
+        created_by=created_by,
+        status="pending"
+    )
+    session.add(job)
+    session.flush()  # Get the ID before committing
+    return job
+
+
+def cancel_issue_jobs(session, issue_id: int):
+    """Cancels pending reminders and escalations for an issue, in the caller's transaction."""
+    session.execute(
+        update(ScheduledJob)
+        .where(ScheduledJob.issue_id == issue_id, ScheduledJob.status == 'pending')
+        .values(status='cancelled')
+    )
+
+
+def cancel_job(job_id: int):
+    """Cancels a pending job. Returns True if it was still pending."""
+    with SessionLocal() as session:
+        with session.begin():
+            result = session.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.id == job_id, ScheduledJob.status == 'pending')
+                .values(status='cancelled')
+            )
+            return result.rowcount == 1
+
+
+def next_run_time(run_at: datetime, interval_seconds: int, now: datetime):
+    """Next occurrence after `now`, skipping any missed while the bot was down."""
+    interval = timedelta(seconds=interval_seconds)
+    missed = max(math.floor((now - run_at) / interval) + 1, 1)
+    return run_at + missed * interval
+
+
+def claim_job(job_id: int, expected_run_at: datetime):
+    """
+    Claims a due job: one-shot jobs become 'done' and recurring ones move to
+    their next run time. Returns the job as a dict, or None if it was
+    cancelled, already claimed or rescheduled.
+    """
+    with SessionLocal() as session:
+        with session.begin():
+            job = session.get(ScheduledJob, job_id)
+            if not job or job.status != 'pending' or job.run_at != expected_run_at:
+                return None
+
+            if job.interval_seconds:
+                values = {'run_at': next_run_time(job.run_at, job.interval_seconds, datetime.now())}
+            else:
+                values = {'status': 'done'}
+
+            result = session.execute(
+                update(ScheduledJob)
+                .where(
+                    ScheduledJob.id == job_id,
+                    ScheduledJob.status == 'pending',
+                    ScheduledJob.run_at == expected_run_at
+                )
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                return None
+
+            return {
+                'id': job.id,
+                'kind': job.kind,
+                'payload': json.loads(job.payload) if job.payload else {},
+                'issue_id': job.issue_id,
+                'created_by': job.created_by,
+                'next_run_at': values.get('run_at')
+            }
+
+
+class Scheduler:
+    """
+    Runs due jobs from `scheduled_jobs` with the handler registered for their kind.
+    Handlers are called as handler(payload, job).
+    """
+
+    def __init__(self):
+        self._heap = []  # (wake_at, job_id, run_at); wake_at is later than run_at when retrying
+        self._handlers = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._stopped = False
+
+    def register(self, kind: str, handler):
+        """Sets the function that runs jobs of this kind."""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Loads every pending job from the database and starts the timer thread."""
+        with SessionLocal() as session:
+            rows = session.execute(
+                select(ScheduledJob.run_at, ScheduledJob.id)
+                .where(ScheduledJob.status == 'pending')
+                .execution_options(yield_per=LOAD_CHUNK_SIZE)
+            )
+            pending = [(run_at, job_id, run_at) for run_at, job_id in rows]
+
+        with self._condition:
+            self._heap.extend(pending)
+            heapq.heapify(self._heap)
+            self._stopped = False
+
+        self._executor = ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS, thread_name_prefix="scheduler")
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+        print(f"⏰ Scheduler started with {len(pending)} pending jobs")
+
+    def stop(self):
+        """Stops the timer thread. Pending jobs stay in the database."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+    def add(self, job_id: int, run_at: datetime, wake_at: datetime = None):
+        """
+        Tells the running scheduler about a committed job (see schedule_job).
+        wake_at delays the attempt past run_at, for retries.
+        """
+        entry = (wake_at or run_at, job_id, run_at)
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            # Only wake the timer thread if this is now the earliest job
+            if self._heap[0] == entry:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    wake_at, job_id, run_at = self._heap[0]
+                    delay = (wake_at - datetime.now()).total_seconds()
+                    if delay <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    self._condition.wait(delay)
+
+            self._executor.submit(self._fire, job_id, run_at)
+
+    def _fire(self, job_id: int, run_at: datetime):
+        try:
+            job = claim_job(job_id, run_at)
+        except Exception as e:
+            # The job is still pending (and if the claim did commit, the retry is
+            # rejected by the compare-and-set), so try again shortly
+            print(f"Could not claim scheduled job {job_id}, retrying in {CLAIM_RETRY_SECONDS}s: {e}")
+            self.add(job_id, run_at, datetime.now() + timedelta(seconds=CLAIM_RETRY_SECONDS))
+            return
+
+        if not job:
+            return
+
+        # Once claimed, a failing handler is not retried (at most once)
+        try:
+            if job['next_run_at']:
+                self.add(job_id, job['next_run_at'])
+
+            handler = self._handlers.get(job['kind'])
+            if not handler:
+                print(f"No handler for scheduled job {job_id} ({job['kind']})")
+                return
+
+            handler(job['payload'], job)
+        except Exception as e:
+            print(f"Scheduled job {job_id} failed: {e}")
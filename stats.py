@@ -0,0 +1,159 @@
+"""
+Incrementally maintained issue statistics.
+
+create_issue and close_issue bump the per-day, per-creator counters in
+`issue_stats` inside their own transaction. /stats only reads those
+counters, so it costs the same however many issues exist.
+
+If the counters ever drift (e.g. after manual SQL), rebuild them from history:
+    python stats.py --backfill
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import select, delete, insert, func
+
+from models import SessionLocal, read_session, Issue, ArchivedIssue, IssueStats, User
+
+COUNTER_COLUMNS = ('opened_count', 'closed_count', 'resolve_seconds')
+
+# Rows read per round trip during a backfill
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def _dialect_insert(dialect_name: str):
+    """Returns the dialect's INSERT construct if it supports ON CONFLICT, else None."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert
+    return None
+
+
+def bump_issue_stats(session, day: date, created_by: int, **increments):
+    """Adds the given increments to one (day, creator) counter row, creating it if needed."""
+    values = {name: increments.get(name, 0) for name in COUNTER_COLUMNS}
+    dialect_insert = _dialect_insert(session.get_bind().dialect.name)
+
+    if dialect_insert is not None:
+        stmt = dialect_insert(IssueStats).values(day=day, created_by=created_by, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IssueStats.day, IssueStats.created_by],
+            set_={name: getattr(IssueStats, name) + stmt.excluded[name] for name in COUNTER_COLUMNS}
+        )
+        session.execute(stmt)
+        return
+
+    row = session.get(IssueStats, (day, created_by), with_for_update=True)
+    if not row:
+        session.add(IssueStats(day=day, created_by=created_by, **values))
+        session.flush()
+        return
+
+    for name in COUNTER_COLUMNS:
+        setattr(row, name, getattr(row, name) + values[name])
+
+
+def record_issue_opened(session, issue: Issue):
+    """Counts a newly created issue. Call after flush, inside the creating transaction."""
+    bump_issue_stats(session, issue.created_at.date(), issue.created_by, opened_count=1)
+
+
+def record_issue_closed(session, issue: Issue):
+    """Counts a closed issue and its time to resolve. Call after flush, inside the closing transaction."""
+    resolve_seconds = int((issue.closed_at - issue.created_at).total_seconds())
+    bump_issue_stats(session, issue.closed_at.date(), issue.created_by,
+                     closed_count=1, resolve_seconds=max(resolve_seconds, 0))
+
+
+def get_issue_stats(days: int = 7, top_admins: int = 5, user_id: int = None):
+    """
+    Summarises the counters: all-time totals, the last `days` days, and
+    the admins who created the most issues. Reads from the replica unless
+    user_id has just written (see models.read_session).
+    """
+    since = date.today() - timedelta(days=days - 1)
+    totals_query = select(
+        func.coalesce(func.sum(IssueStats.opened_count), 0),
+        func.coalesce(func.sum(IssueStats.closed_count), 0),
+        func.coalesce(func.sum(IssueStats.resolve_seconds), 0)
+    )
+
+    with read_session(user_id) as session:
+        opened, closed, resolve_seconds = session.execute(totals_query).one()
+        recent_opened, recent_closed, _ = session.execute(
+            totals_query.where(IssueStats.day >= since)
+        ).one()
+
+        opened_per_admin = func.sum(IssueStats.opened_count)
+        admin_rows = session.execute(
+            select(User.user_id, User.full_name, User.first_name, opened_per_admin, func.sum(IssueStats.closed_count))
+            .join(User, User.user_id == IssueStats.created_by)
+            .group_by(User.user_id, User.full_name, User.first_name)
+            .order_by(opened_per_admin.desc())
+            .limit(top_admins)
+        ).all()
+
+    return {
+        'opened': opened,
+        'closed': closed,
+        'open': opened - closed,
+        'mean_resolve_seconds': resolve_seconds / closed if closed else None,
+        'days': days,
+        'recent_opened': recent_opened,
+        'recent_closed': recent_closed,
+        'admins': [{
+            'user_id': row[0],
+            'name': row[1] or row[2] or str(row[0]),
+            'opened': row[3],
+            'closed': row[4]
+        } for row in admin_rows]
+    }
+
+
+def backfill_issue_stats():
+    """
+    Rebuilds issue_stats from the issues and issues_archive tables.
+    Runs as one transaction, so /stats sees either the old or the new numbers.
+    Returns the number of counter rows written.
+    """
+    counters = defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+
+    with SessionLocal() as session:
+        with session.begin():
+            for model in (Issue, ArchivedIssue):
+                rows = session.execute(
+                    select(model.created_by, model.created_at, model.closed_at, model.status)
+                    .execution_options(yield_per=BACKFILL_CHUNK_SIZE)
+                )
+                for created_by, created_at, closed_at, status in rows:
+                    counters[(created_at.date(), created_by)]['opened_count'] += 1
+                    if status == 'closed' and closed_at:
+                        closed = counters[(closed_at.date(), created_by)]
+                        closed['closed_count'] += 1
+                        closed['resolve_seconds'] += max(int((closed_at - created_at).total_seconds()), 0)
+
+            session.execute(delete(IssueStats))
+            if counters:
+                session.execute(insert(IssueStats), [
+                    {'day': day, 'created_by': created_by, **values}
+                    for (day, created_by), values in counters.items()
+                ])
+
+    return len(counters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Issue statistics maintenance.")
+    parser.add_argument('--backfill', action='store_true',
+                        help="rebuild issue_stats from the full issue history")
+    args = parser.parse_args()
+
+    if args.backfill:
+        written = backfill_issue_stats()
+        print(f"✅ Rebuilt issue statistics ({written} day/admin rows).")
+    else:
+        parser.print_help()
@@ -0,0 +1,131 @@
+import pytest
+from sqlalchemy import select, delete
+
+import models
+from models import SessionLocal, User, UserHierarchy
+from hierarchy import add_to_hierarchy, set_manager, get_subordinate_ids, rebuild_hierarchy
+
+
+def add_users(*user_ids):
+    with SessionLocal() as session:
+        with session.begin():
+            for user_id in user_ids:
+                session.add(User(user_id=user_id))
+                add_to_hierarchy(session, user_id)
+
+
+def move(user_id, manager_id):
+    with SessionLocal() as session:
+        with session.begin():
+            set_manager(session, user_id, manager_id)
+
+
+def closure_rows():
+    with SessionLocal() as session:
+        return set(session.execute(
+            select(UserHierarchy.ancestor_id, UserHierarchy.descendant_id, UserHierarchy.depth)
+        ).all())
+
+
+def test_insert_links_every_ancestor(db):
+    add_users(1, 2, 3)
+    move(2, 1)
+    move(3, 2)
+
+    assert sorted(get_subordinate_ids(1)) == [2, 3]
+    assert get_subordinate_ids(2) == [3]
+    assert get_subordinate_ids(3) == []
+    assert (1, 3, 2) in closure_rows()
+
+
+def test_move_takes_the_subtree_along(db):
+    add_users(1, 2, 3, 4)
+    move(2, 1)
+    move(3, 2)
+
+    move(2, 4)
+
+    assert get_subordinate_ids(1) == []
+    assert sorted(get_subordinate_ids(4)) == [2, 3]
+    assert get_subordinate_ids(2) == [3]
+    assert (4, 3, 2) in closure_rows()
+
+
+def test_move_to_top_level(db):
+    add_users(1, 2, 3)
+    move(2, 1)
+    move(3, 2)
+
+    move(2, None)
+
+    assert get_subordinate_ids(1) == []
+    assert get_subordinate_ids(2) == [3]
+    with SessionLocal() as session:
+        assert session.get(User, 2).manager_id is None
+
+
+def test_incremental_matches_rebuild(db):
+    add_users(1, 2, 3, 4, 5)
+    move(2, 1)
+    move(3, 1)
+    move(4, 3)
+    move(5, 4)
+    move(3, 2)
+    incremental = closure_rows()
+
+    rebuild_hierarchy()
+
+    assert closure_rows() == incremental
+
+
+@pytest.mark.parametrize('user_id, manager_id', [(1, 1), (1, 3), (2, 3)])
+def test_cycles_are_rejected(db, user_id, manager_id):
+    add_users(1, 2, 3)
+    move(2, 1)
+    move(3, 2)
+    before = closure_rows()
+
+    with pytest.raises(ValueError):
+        move(user_id, manager_id)
+
+    assert closure_rows() == before
+
+
+def test_users_missing_from_closure_table_can_be_moved(db):
+    add_users(1, 2)
+    with SessionLocal() as session:
+        with session.begin():
+            session.execute(delete(UserHierarchy))
+
+    move(2, 1)
+
+    assert get_subordinate_ids(1) == [2]
+
+
+def test_init_db_builds_from_existing_manager_ids(db):
+    # Reports that predate the closure table, e.g. from a directory import
+    with SessionLocal() as session:
+        with session.begin():
+            session.add(User(user_id=10))
+            session.flush()
+            session.add_all([User(user_id=11, manager_id=10), User(user_id=12, manager_id=10), User(user_id=13)])
+            session.execute(delete(UserHierarchy))
+
+    models.init_db()
+    move(13, 10)
+
+    assert sorted(get_subordinate_ids(10)) == [11, 12, 13]
+
+
+def test_rebuild_tolerates_manager_id_cycles(db):
+    add_users(1, 2)
+    with SessionLocal() as session:
+        with session.begin():
+            session.get(User, 1).manager_id = 2
+            session.get(User, 2).manager_id = 1
+
+    rebuild_hierarchy()
+
+    assert get_subordinate_ids(1) == [2]
+    assert get_subordinate_ids(2) == [1]
+    assert (1, 1, 0) in closure_rows()
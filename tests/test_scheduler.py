@@ -0,0 +1,171 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import scheduler
+from models import SessionLocal, ScheduledJob
+from scheduler import Scheduler, schedule_job, cancel_issue_jobs, cancel_job, next_run_time, claim_job
+
+
+def add_job(kind='test', run_at=None, **kwargs):
+    with SessionLocal() as session:
+        with session.begin():
+            job = schedule_job(session, kind, run_at or datetime.now(), **kwargs)
+            return job.id, job.run_at
+
+
+def job_status(job_id):
+    with SessionLocal() as session:
+        job = session.get(ScheduledJob, job_id)
+        return job.status, job.run_at
+
+
+@pytest.mark.parametrize('now, expected', [
+    # Not due yet, or exactly due: the following occurrence
+    (datetime(2025, 1, 1, 9, 0), datetime(2025, 1, 1, 11, 0)),
+    (datetime(2025, 1, 1, 10, 0), datetime(2025, 1, 1, 11, 0)),
+    (datetime(2025, 1, 1, 10, 30), datetime(2025, 1, 1, 11, 0)),
+    # Down for several intervals: missed runs are skipped, not replayed
+    (datetime(2025, 1, 1, 13, 30), datetime(2025, 1, 1, 14, 0)),
+    (datetime(2025, 1, 3, 10, 0), datetime(2025, 1, 3, 11, 0)),
+])
+def test_next_run_time_skips_missed_runs(now, expected):
+    assert next_run_time(datetime(2025, 1, 1, 10, 0), 3600, now) == expected
+
+
+def test_one_shot_job_is_claimed_once(db):
+    job_id, run_at = add_job(payload={'x': 1}, issue_id=7, created_by=3)
+
+    job = claim_job(job_id, run_at)
+
+    assert job['payload'] == {'x': 1}
+    assert job['issue_id'] == 7
+    assert job['next_run_at'] is None
+    assert job_status(job_id)[0] == 'done'
+    assert claim_job(job_id, run_at) is None
+
+
+def test_recurring_job_moves_forward_and_rejects_stale_entry(db):
+    run_at = datetime.now() - timedelta(hours=5, minutes=30)
+    job_id, run_at = add_job(run_at=run_at, interval_seconds=3600)
+
+    job = claim_job(job_id, run_at)
+
+    assert job['next_run_at'] > datetime.now()
+    assert job['next_run_at'] - datetime.now() <= timedelta(hours=1)
+    assert job_status(job_id) == ('pending', job['next_run_at'])
+
+    # A second heap entry for the old time (e.g. loaded at startup) must not fire again
+    assert claim_job(job_id, run_at) is None
+    assert claim_job(job_id, job['next_run_at']) is not None
+
+
+def test_cancelled_jobs_are_not_claimed(db):
+    job_id, run_at = add_job()
+    issue_job_id, issue_run_at = add_job(issue_id=5, interval_seconds=60)
+    other_job_id, other_run_at = add_job(issue_id=6)
+
+    assert cancel_job(job_id)
+    assert not cancel_job(job_id)
+    with SessionLocal() as session:
+        with session.begin():
+            cancel_issue_jobs(session, 5)
+
+    assert claim_job(job_id, run_at) is None
+    assert claim_job(issue_job_id, issue_run_at) is None
+    assert job_status(issue_job_id)[0] == 'cancelled'
+    assert claim_job(other_job_id, other_run_at) is not None
+
+
+def test_claim_is_exclusive_across_threads(db):
+    job_id, run_at = add_job()
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(claim_job(job_id, run_at))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([job for job in results if job]) == 1
+
+
+def test_scheduler_runs_due_jobs_once(db):
+    fired = []
+    done = threading.Event()
+
+    def handler(payload, job):
+        fired.append(payload['n'])
+        if len(fired) == 2:
+            done.set()
+
+    cancelled_id, _ = add_job(payload={'n': 0})
+    cancel_job(cancelled_id)
+    first_id, first_run_at = add_job(payload={'n': 1}, run_at=datetime.now() - timedelta(minutes=1))
+
+    runner = Scheduler()
+    runner.register('test', handler)
+    runner.start()
+    try:
+        # Duplicate heap entry for an already loaded job
+        runner.add(first_id, first_run_at)
+        later_id, later_run_at = add_job(payload={'n': 2}, run_at=datetime.now() + timedelta(milliseconds=200))
+        runner.add(later_id, later_run_at)
+
+        assert done.wait(5)
+    finally:
+        runner.stop()
+
+    assert sorted(fired) == [1, 2]
+
+
+def test_scheduler_retries_failed_claims(db, monkeypatch):
+    done = threading.Event()
+    attempts = []
+
+    def flaky_claim(job_id, run_at):
+        attempts.append(job_id)
+        if len(attempts) == 1:
+            raise RuntimeError("database is briefly unavailable")
+        return claim_job(job_id, run_at)
+
+    monkeypatch.setattr(scheduler, 'claim_job', flaky_claim)
+    monkeypatch.setattr(scheduler, 'CLAIM_RETRY_SECONDS', 0.1)
+    job_id, _ = add_job()
+
+    runner = Scheduler()
+    runner.register('test', lambda payload, job: done.set())
+    runner.start()
+    try:
+        assert done.wait(5)
+    finally:
+        runner.stop()
+
+    assert attempts == [job_id, job_id]
+    assert job_status(job_id)[0] == 'done'
+
+
+def test_scheduler_does_not_retry_failed_handlers(db):
+    calls = []
+    called = threading.Event()
+
+    def handler(payload, job):
+        calls.append(job['id'])
+        called.set()
+        raise RuntimeError("Bale is down")
+
+    job_id, _ = add_job()
+
+    runner = Scheduler()
+    runner.register('test', handler)
+    runner.start()
+    try:
+        assert called.wait(5)
+        time.sleep(0.2)
+    finally:
+        runner.stop()
+
+    assert calls == [job_id]
+    assert job_status(job_id)[0] == 'done'